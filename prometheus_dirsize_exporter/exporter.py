@@ -1,15 +1,24 @@
 import os
+import stat
 import time
+import logging
 import argparse
+import threading
+import contextlib
+import concurrent.futures
 from typing import Callable, Never, Optional, Generator
 from prometheus_client import start_http_server
-from . import metrics
+from . import dirents, metrics, statx
 from dataclasses import dataclass
 
-type Timestamp = float
+logger = logging.getLogger(__name__)
+
+# Unix timestamp, in nanoseconds. Kept as an int so comparing them is cheap.
+type Timestamp = int
 type Seconds = float
+type GaugeSetter = Callable[[float], None]
 
-@dataclass
+@dataclass(slots=True)
 class DirInfo:
     path: str
     size: int
@@ -20,162 +29,476 @@ class DirInfo:
 
 ONE_S_IN_NS = 1_000_000_000
 
+# How many runs to remember that a tlon_ volume had no .urb directory for, before
+# looking again. Counted in runs rather than time, as a single run can take
+# anywhere from seconds to hours depending on the IOPS budget.
+NO_URB_DIRECTORY_CACHE_RUNS = 6
+
+# Maps a tlon_ volume's path to the directory with .urb in it (or None if there
+# was none), and the run in which we found that out.
+type UrbDirectoryCache = dict[str, tuple[Optional[str], int]]
+
+
+class CachedEntry:
+    """
+    A directory entry whose stat information is looked up at most once.
+
+    Type checks are answered from the d_type we got when listing the directory.
+    stat() makes a single stat call relative to the parent directory the first
+    time it is called, and returns that same result after. On filesystems that
+    do not report d_type, the type checks use that stat call too.
+    """
+    __slots__ = ("name", "_d_type", "_dir_fd", "_stat")
+
+    def __init__(self, name: str, d_type: int, dir_fd: int):
+        self.name = name
+        self._d_type = d_type
+        self._dir_fd = dir_fd
+        self._stat: Optional[statx.StatResult] = None
+
+    @property
+    def d_type(self) -> int:
+        if self._d_type == dirents.DT_UNKNOWN:
+            self._d_type = stat.S_IFMT(self.stat().st_mode) >> 12
+        return self._d_type
+
+    @property
+    def is_file(self) -> bool:
+        return self.d_type == dirents.DT_REG
+
+    @property
+    def is_dir(self) -> bool:
+        return self.d_type == dirents.DT_DIR
+
+    @property
+    def is_symlink(self) -> bool:
+        return self.d_type == dirents.DT_LNK
+
+    def stat(self) -> statx.StatResult:
+        if self._stat is None:
+            # Do not follow symlinks, as that may lead to double counting a symlinked
+            # file's size.
+            self._stat = statx.stat(
+                self.name, dir_fd=self._dir_fd, follow_symlinks=False
+            )
+        return self._stat
+
+
+class _PendingDirInfo:
+    """
+    Running totals for a directory whose walk has not finished yet.
+    """
+    __slots__ = (
+        "fd",
+        "entries",
+        "start_time",
+        "size",
+        "latest_mtime",
+        "oldest_mtime",
+        "entries_count",
+    )
+
+    def __init__(self, fd: int, entries, start_time: Seconds, statinfo: statx.StatResult):
+        self.fd = fd
+        # dirents.scandir iterator over fd, consumed as the directory is walked
+        self.entries = entries
+        self.start_time = start_time
+        self.size = statinfo.st_size
+        self.latest_mtime = statinfo.st_mtime_ns
+        self.oldest_mtime = statinfo.st_mtime_ns
+        self.entries_count = 1  # Include this directory as an entry
+
+    def close(self) -> None:
+        self.entries.close()
+        os.close(self.fd)
+
+    def add_files(self, files: list[CachedEntry]) -> None:
+        # This runs once per file, so work on locals and only write the
+        # totals back at the end.
+        size = self.size
+        latest_mtime = self.latest_mtime
+        oldest_mtime = self.oldest_mtime
+        for f in files:
+            try:
+                stat_info = f.stat()
+            except FileNotFoundError:
+                # File might have been deleted from the time we listed it and now
+                continue
+            size += stat_info.st_size
+            mtime = stat_info.st_mtime_ns
+            if latest_mtime < mtime:
+                latest_mtime = mtime
+            if oldest_mtime > mtime:
+                oldest_mtime = mtime
+        self.size = size
+        self.latest_mtime = latest_mtime
+        self.oldest_mtime = oldest_mtime
+
+    def add_subdir(self, subdir: "_PendingDirInfo") -> None:
+        self.size += subdir.size
+        self.entries_count += subdir.entries_count
+        if self.latest_mtime < subdir.latest_mtime:
+            self.latest_mtime = subdir.latest_mtime
+        if self.oldest_mtime > subdir.oldest_mtime:
+            self.oldest_mtime = subdir.oldest_mtime
+
 
 class BudgetedDirInfoWalker:
-    def __init__(self, iops_budget: int=100):
+    def __init__(
+        self,
+        iops_budget: int=100,
+        urb_directory_cache: Optional[UrbDirectoryCache]=None,
+        run: int=0,
+    ):
         """
         iops_budget is number of io operations allowed every second.
+
+        urb_directory_cache can be shared between walkers, so runs after the
+        first do not need to search tlon_ volumes for their .urb directory again.
+        run is the number of the run this walker is used for, counting up from 0,
+        and is used to expire entries in urb_directory_cache.
         """
         self.iops_budget = iops_budget
+        self._urb_directory_cache = {} if urb_directory_cache is None else urb_directory_cache
+        self._run = run
         # Use _ns to avoid subtractive messiness possible when using floats
         self._last_iops_reset_time = time.monotonic_ns()
         self._io_calls_since_last_reset = 0
+        # The budget is shared by all the threads walking directories
+        self._iops_lock = threading.Lock()
+        # Walk sibling directories in parallel, so more IO can be in flight at once
+        # on high latency filesystems (like NFS). This does not change how many IOPS
+        # we use, only how much time we spend waiting on each one. Not worth it with
+        # tiny budgets.
+        max_workers = min(32, iops_budget // 10)
+        if max_workers > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = None
+            max_workers = 1
+        self._max_workers = max_workers
+        # How many file stats to reserve budget for at once. Each thread gets
+        # its share of the budget, so one thread reserving a batch does not use
+        # up the whole second's budget and stall all the others.
+        self._file_batch_size = max(iops_budget // max_workers, 1)
+
+    def shutdown(self) -> None:
+        """
+        Stop the threads used for walking directories in parallel.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def reserve_iops(self, count: int = 1) -> None:
+        """
+        Account for `count` upcoming IOs, waiting if necessary so they are within budget.
+
+        count should not be more than iops_budget, or we will go over budget.
+        """
+        with self._iops_lock:
+            # This is called for every IO we do, so read the clock just once
+            now = time.monotonic_ns()
+            if now - self._last_iops_reset_time > ONE_S_IN_NS:
+                # One second has passed since last time we reset the budget clock
+                # So we reset it again now, regardless of how many iops have happened
+                self._io_calls_since_last_reset = 0
+                self._last_iops_reset_time = now
+
+            if self._io_calls_since_last_reset + count - 1 > self.iops_budget:
+                # We are over budget, so we wait for 1s + 1ns since last reset
+                # IO can be performed once this is wait is done. We reset the budget clock
+                # after our wait.
+                time.sleep(
+                    (ONE_S_IN_NS - (now - self._last_iops_reset_time) + 1) / ONE_S_IN_NS
+                )
+                self._io_calls_since_last_reset = 0
+                self._last_iops_reset_time = time.monotonic_ns()
+
+            self._io_calls_since_last_reset += count
 
     def do_iops_action[R, **P](self, func: Callable[P, R], *args, **kwargs) -> R:
         """
         Perform an action that does IO, waiting if necessary so it is within budget.
 
-        All IO performed should be wrapped with this function, so we do not exceed
-        our budget. Each call to this function is treated as one IO.
+        All IO performed should be wrapped with this function (or accounted for
+        with reserve_iops), so we do not exceed our budget. Each call to this
+        function is treated as one IO.
         """
-        if time.monotonic_ns() - self._last_iops_reset_time > ONE_S_IN_NS:
-            # One second has passed since last time we reset the budget clock
-            # So we reset it again now, regardless of how many iops have happened
-            self._io_calls_since_last_reset = 0
-            self._last_iops_reset_time = time.monotonic_ns()
-
-        if self._io_calls_since_last_reset > self.iops_budget:
-            # We are over budget, so we wait for 1s + 1ns since last reset
-            # IO can be performed once this is wait is done. We reset the budget clock
-            # after our wait.
-            wait_period_in_s = (
-                ONE_S_IN_NS - (time.monotonic_ns() - self._last_iops_reset_time) + 1
-            ) / ONE_S_IN_NS
-            time.sleep(wait_period_in_s)
-            self._io_calls_since_last_reset = 0
-            self._last_iops_reset_time = time.monotonic_ns()
-
-        return_value = func(*args, **kwargs)
-        self._io_calls_since_last_reset += 1
-        return return_value
+        self.reserve_iops()
+        return func(*args, **kwargs)
 
     def find_urb_directory(self, base_path: str) -> Optional[str]:
         """
         Find the first subdirectory that contains a .urb subdirectory.
         Only used for tlon_ volumes.
+
+        Results are cached. A cached directory is checked to still have .urb
+        before it is used, which takes one IO rather than one per subdirectory.
+        Volumes without a .urb directory are only searched again once
+        NO_URB_DIRECTORY_CACHE_RUNS runs have passed.
         """
         try:
-            children = [
-                os.path.join(base_path, c)
-                for c in self.do_iops_action(os.listdir, base_path)
-            ]
-            
-            dirs = [c for c in children if self.do_iops_action(os.path.isdir, c)]
-            
-            for d in dirs:
+            cached = self._urb_directory_cache.get(base_path)
+            if cached is not None:
+                urb_dir, checked_run = cached
+                if urb_dir is not None:
+                    if self.do_iops_action(os.path.isdir, os.path.join(urb_dir, '.urb')):
+                        return urb_dir
+                elif self._run - checked_run < NO_URB_DIRECTORY_CACHE_RUNS:
+                    return None
+
+            urb_dir = self._search_urb_directory(base_path)
+            self._urb_directory_cache[base_path] = (urb_dir, self._run)
+            return urb_dir
+        except (OSError, PermissionError):
+            return None
+
+    def _search_urb_directory(self, base_path: str) -> Optional[str]:
+        with contextlib.closing(self._list_subdirs(base_path)) as subdirs:
+            for name in subdirs:
+                d = os.path.join(base_path, name)
                 urb_path = os.path.join(d, '.urb')
                 if self.do_iops_action(os.path.isdir, urb_path):
                     return d
-            
-            return None
-        except (OSError, PermissionError):
-            return None
+
+        return None
+
+    def _list_subdirs(self, dir_path: str) -> Generator[str, None, None]:
+        """
+        Yield the name of each subdirectory of dir_path, following symlinks.
+
+        Entry types come from the directory listing itself where the filesystem
+        tells us about them. Symlinks, and entries on filesystems that do not
+        (like plain NFS READDIR), need a stat to find out if they are
+        directories. That stat is budgeted like any other IO, unlike the one
+        os.DirEntry.is_dir() would make.
+        """
+        fd = self.do_iops_action(
+            os.open, dir_path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+        )
+        try:
+            for name, d_type in self.do_iops_action(dirents.scandir, fd):
+                is_dir = d_type == dirents.DT_DIR
+                if d_type == dirents.DT_UNKNOWN or d_type == dirents.DT_LNK:
+                    try:
+                        statinfo = self.do_iops_action(statx.stat, name, dir_fd=fd)
+                    except FileNotFoundError:
+                        # Entry was deleted from the time it was listed and now,
+                        # or is a symlink pointing nowhere
+                        continue
+                    is_dir = stat.S_ISDIR(statinfo.st_mode)
+                if is_dir:
+                    yield name
+        finally:
+            os.close(fd)
 
     def get_dir_info(self, path: str) -> Optional[DirInfo]:
+        return self.get_dir_info_at(None, path, follow_symlinks=True)
+
+    def get_dir_info_at(
+        self, dir_fd: Optional[int], name: str, follow_symlinks: bool = False
+    ) -> Optional[DirInfo]:
+        """
+        Get info about directory `name`, relative to the open directory `dir_fd`.
+
+        Each directory is opened once, and all its children are looked up relative
+        to it, so the kernel does not have to resolve the full path from the root
+        for every single entry.
+
+        If we have a thread pool, each immediate subdirectory is walked in its
+        own thread. They all share the same IOPS budget.
+        """
+        root = self._open_dir(dir_fd, name, follow_symlinks)
+        if root is None:
+            return None
+
+        if self._executor is not None:
+            try:
+                self._walk_subdirs_in_parallel(root)
+            except BaseException:
+                root.close()
+                raise
+        self._walk(root)
+
+        return DirInfo(
+            path=os.path.basename(name),
+            size=root.size,
+            latest_mtime=root.latest_mtime,
+            oldest_mtime=root.oldest_mtime,
+            entries_count=root.entries_count,
+            processing_time=time.monotonic() - root.start_time,
+        )
+
+    def _walk(self, root: _PendingDirInfo) -> None:
+        """
+        Walk all the subdirectories of root, adding them to its totals.
+
+        The tree is walked depth first with an explicit stack rather than with
+        recursion, so arbitrarily deep trees do not hit the recursion limit.
+        Each directory's entries are consumed as we go, descending into
+        subdirectories as they are found, so we never hold a full listing
+        of any directory. A directory's totals are merged into its parent's
+        once all of its entries have been seen. All fds, including root's,
+        are closed once this returns.
+        """
+        stack = [root]
+        try:
+            while stack:
+                current = stack[-1]
+                subdir_name = self._next_subdir(current)
+                if subdir_name is not None:
+                    subdir = self._open_dir(current.fd, subdir_name)
+                    # subdir is None if the directory was deleted between the
+                    # time the listing was done and now.
+                    if subdir is not None:
+                        stack.append(subdir)
+                    continue
+                stack.pop()
+                current.close()
+                if stack:
+                    stack[-1].add_subdir(current)
+        finally:
+            for pending in stack:
+                pending.close()
+
+    def _walk_subdir(self, dir_fd: int, name: str) -> Optional[_PendingDirInfo]:
+        subdir = self._open_dir(dir_fd, name)
+        if subdir is not None:
+            self._walk(subdir)
+        return subdir
+
+    def _walk_subdirs_in_parallel(self, root: _PendingDirInfo) -> None:
+        """
+        Walk each immediate subdirectory of root in the thread pool, adding them to its totals.
+
+        Only a few more walks than we have threads are submitted at a time, and
+        finished ones are merged into root as they complete, so memory use does
+        not grow with the number of subdirectories.
+        """
+        max_in_flight = 2 * self._max_workers
+        in_flight = set()
+        try:
+            while (d := self._next_subdir(root)) is not None:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = concurrent.futures.wait(
+                        in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    self._add_walked_subdirs(root, done)
+                in_flight.add(self._executor.submit(self._walk_subdir, root.fd, d))
+        finally:
+            # The subdirectories are opened relative to root.fd, so all walks
+            # must be done before anyone gets a chance to close it.
+            done, _ = concurrent.futures.wait(in_flight)
+        self._add_walked_subdirs(root, done)
+
+    def _add_walked_subdirs(
+        self, root: _PendingDirInfo, futures: set[concurrent.futures.Future]
+    ) -> None:
+        for future in futures:
+            subdir = future.result()
+            # subdir is None if the directory was deleted between the
+            # time the listing was done and now.
+            if subdir is not None:
+                root.add_subdir(subdir)
+
+    def _open_dir(
+        self, dir_fd: Optional[int], name: str, follow_symlinks: bool = False
+    ) -> Optional[_PendingDirInfo]:
+        """
+        Open directory `name` relative to `dir_fd`, and start listing it.
+
+        Returns None if the directory no longer exists. The caller is responsible
+        for closing the returned _PendingDirInfo.
+        """
         start_time = time.monotonic()
+        flags = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+        if not follow_symlinks:
+            flags |= os.O_NOFOLLOW
         try:
-            self_statinfo = self.do_iops_action(os.stat, path)
+            fd = self.do_iops_action(os.open, name, flags, dir_fd=dir_fd)
         except FileNotFoundError:
             # Directory was deleted from the time it was listed and now
             return None
 
-        # Get absolute path of all children of directory
-        children = [
-            os.path.abspath(os.path.join(path, c))
-            for c in self.do_iops_action(os.listdir, path)
-        ]
-        # Split into files and directories for different kinds of traversal.
-        # We count symlinks as files, but do not resolve them when checking size -
-        # but do include them in the mtime calculation.
-        files = [
-            c
-            for c in children
-            if self.do_iops_action(os.path.isfile, c)
-            or self.do_iops_action(os.path.islink, c)
-        ]
-        dirs = [c for c in children if self.do_iops_action(os.path.isdir, c)]
-
-        total_size = self_statinfo.st_size
-        latest_mtime = self_statinfo.st_mtime
-        oldest_mtime = self_statinfo.st_mtime
-        entries_count = len(files) + 1  # Include this directory as an entry
+        try:
+            statinfo = self.do_iops_action(statx.stat, fd)
+            entries = self.do_iops_action(dirents.scandir, fd)
+        except BaseException:
+            os.close(fd)
+            raise
 
-        for f in files:
-            # Do not follow symlinks, as that may lead to double counting a symlinked
-            # file's size.
+        return _PendingDirInfo(fd, entries, start_time, statinfo)
+
+    def _next_subdir(self, pending: _PendingDirInfo) -> Optional[str]:
+        """
+        Account for pending's files up to its next subdirectory, and return its name.
+
+        Returns None once all the entries of the directory have been seen.
+        """
+        # We count symlinks as files, but do not resolve them when checking size -
+        # but do include them in the mtime calculation. The type checks are
+        # answered from the directory listing itself (d_type) on most
+        # filesystems, so they do not need any IO.
+        # File stats are done as we go, with budget reserved a batch at a time
+        # rather than paying for the budget bookkeeping on every single file.
+        # Each file is stat'd exactly once, when its size is first looked up.
+        batch_size = self._file_batch_size
+        files: list[CachedEntry] = []
+        subdir_name = None
+        for name, d_type in pending.entries:
+            cached_entry = CachedEntry(name, d_type, pending.fd)
             try:
-                stat_info = self.do_iops_action(os.stat, f, follow_symlinks=False)
+                if d_type == dirents.DT_UNKNOWN:
+                    # The filesystem did not tell us what type of entry this is,
+                    # so we must stat it to find out. That is an IO like any other.
+                    # Files reuse this stat for their size & mtime.
+                    self.do_iops_action(cached_entry.stat)
+                is_dir = cached_entry.is_dir
             except FileNotFoundError:
-                # File might have been deleted from the time we listed it and now
-                continue
-            total_size += stat_info.st_size
-            if latest_mtime < stat_info.st_mtime:
-                latest_mtime = stat_info.st_mtime
-            if oldest_mtime > stat_info.st_mtime:
-                oldest_mtime = stat_info.st_mtime
-
-        for d in dirs:
-            dirinfo = self.get_dir_info(d)
-            if dirinfo is None:
-                # The directory was deleted between the time the listing
-                # was done and now.
+                # Entry was deleted from the time it was listed and now
                 continue
-            total_size += dirinfo.size
-            entries_count += dirinfo.entries_count
-            if latest_mtime < dirinfo.latest_mtime:
-                latest_mtime = dirinfo.latest_mtime
-            if oldest_mtime > dirinfo.oldest_mtime:
-                oldest_mtime = dirinfo.oldest_mtime
-
-        return DirInfo(
-            path=os.path.basename(path),
-            size=total_size,
-            latest_mtime=latest_mtime,
-            oldest_mtime=oldest_mtime,
-            entries_count=entries_count,
-            processing_time=time.monotonic() - start_time,
-        )
+            if is_dir:
+                subdir_name = cached_entry.name
+                break
+            if cached_entry.is_file or cached_entry.is_symlink:
+                pending.entries_count += 1
+                if d_type == dirents.DT_UNKNOWN:
+                    # Already stat'd (and budgeted for) above
+                    pending.add_files([cached_entry])
+                    continue
+                files.append(cached_entry)
+                if len(files) == batch_size:
+                    self.reserve_iops(len(files))
+                    pending.add_files(files)
+                    files.clear()
+        if files:
+            self.reserve_iops(len(files))
+            pending.add_files(files)
+        return subdir_name
 
     def get_subdirs_info(self, dir_path: str) -> Generator[tuple[str, DirInfo] | None, None, None]:
         try:
-            children = [
-                os.path.abspath(os.path.join(dir_path, c))
-                for c in self.do_iops_action(os.listdir, dir_path)
-            ]
-
-            dirs = [c for c in children if self.do_iops_action(os.path.isdir, c)]
-
-            for c in dirs:
-                dir_name = os.path.basename(c)
-                
-                # For tlon_ volumes, look for .urb subdirectory
-                if "tlon_" in dir_name:
-                    urb_dir = self.find_urb_directory(c)
-                    if urb_dir:
-                        dirinfo = self.get_dir_info(urb_dir)
-                        if dirinfo:
-                            # Use the original directory name but measure the urb subdirectory
-                            yield (dir_name, dirinfo)
+            with contextlib.closing(self._list_subdirs(dir_path)) as subdirs:
+                for dir_name in subdirs:
+                    c = os.path.join(dir_path, dir_name)
+                    # For tlon_ volumes, look for .urb subdirectory
+                    if dir_name.startswith("tlon_"):
+                        urb_dir = self.find_urb_directory(c)
+                        if urb_dir:
+                            dirinfo = self.get_dir_info(urb_dir)
+                            if dirinfo:
+                                # Use the original directory name but measure the urb subdirectory
+                                yield (dir_name, dirinfo)
+                        else:
+                            # No .urb found, measure the whole directory
+                            dirinfo = self.get_dir_info(c)
+                            if dirinfo:
+                                yield (dir_name, dirinfo)
                     else:
-                        # No .urb found, measure the whole directory
+                        # Non-tlon volumes, measure normally
                         dirinfo = self.get_dir_info(c)
                         if dirinfo:
                             yield (dir_name, dirinfo)
-                else:
-                    # Non-tlon volumes, measure normally
-                    dirinfo = self.get_dir_info(c)
-                    if dirinfo:
-                        yield (dir_name, dirinfo)
         except OSError as e:
             if e.errno == 116:
                 # See https://github.com/yuvipanda/prometheus-dirsize-exporter/issues/6
@@ -223,37 +546,72 @@ def main() -> Never:
     argparser.add_argument(
         "--port", help="Port for the server to listen on", type=int, default=8000
     )
+    argparser.add_argument(
+        "--log-level",
+        help="Level to log at. Per directory progress is logged at DEBUG",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+        default="INFO",
+    )
 
     args = argparser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    # Resolve this once, so all the paths we build from it are already absolute
+    parent_dir = os.path.abspath(args.parent_dir)
 
     start_http_server(args.port)
     
     # track currently active directories to clean up stale metrics
     active_directories = set()
+    # setters of the labeled gauges for each active directory, so we only look them up once
+    labeled_metric_setters: dict[
+        str, tuple[GaugeSetter, GaugeSetter, GaugeSetter, GaugeSetter, GaugeSetter]
+    ] = {}
     
+    # remember where the .urb directory of tlon_ volumes is across runs
+    urb_directory_cache: UrbDirectoryCache = {}
+    run = 0
+
     while True:
-        walker = BudgetedDirInfoWalker(args.iops_budget)
+        walker = BudgetedDirInfoWalker(args.iops_budget, urb_directory_cache, run)
         current_directories = set()
         
-        for result in walker.get_subdirs_info(args.parent_dir):
+        for result in walker.get_subdirs_info(parent_dir):
             if result is None:
                 continue
                 
             dir_name, subdir_info = result
             current_directories.add(dir_name)
             
-            metrics.TOTAL_SIZE.labels(dir_name).set(subdir_info.size)
-            metrics.LATEST_MTIME.labels(dir_name).set(subdir_info.latest_mtime)
-            metrics.OLDEST_MTIME.labels(dir_name).set(subdir_info.oldest_mtime)
-            metrics.ENTRIES_COUNT.labels(dir_name).set(subdir_info.entries_count)
+            setters = labeled_metric_setters.get(dir_name)
+            if setters is None:
+                setters = labeled_metric_setters[dir_name] = (
+                    metrics.TOTAL_SIZE.labels(dir_name).set,
+                    metrics.LATEST_MTIME.labels(dir_name).set,
+                    metrics.OLDEST_MTIME.labels(dir_name).set,
+                    metrics.ENTRIES_COUNT.labels(dir_name).set,
+                    metrics.LAST_UPDATED.labels(dir_name).set,
+                )
+            set_total_size, set_latest_mtime, set_oldest_mtime, set_entries_count, set_last_updated = setters
+
+            set_total_size(subdir_info.size)
+            set_latest_mtime(subdir_info.latest_mtime / ONE_S_IN_NS)
+            set_oldest_mtime(subdir_info.oldest_mtime / ONE_S_IN_NS)
+            set_entries_count(subdir_info.entries_count)
             if args.enable_detailed_processing_time_metric:
                 metrics.PROCESSING_TIME.labels(dir_name).set(subdir_info.processing_time)
-            metrics.LAST_UPDATED.labels(dir_name).set(time.time())
-            print(f"Updated values for {dir_name}")
-        
+            # Read the clock for each directory rather than once per run - with a
+            # small IOPS budget, a single run can take hours, and this should say
+            # when this particular directory was measured.
+            set_last_updated(time.time())
+            logger.debug("Updated values for %s", dir_name)
+        walker.shutdown()
+
         # clean up metrics for directories that no longer exist
         stale_directories = active_directories - current_directories
         for stale_dir in stale_directories:
+            labeled_metric_setters.pop(stale_dir, None)
+            # Cache is keyed by full path, as built by get_subdirs_info
+            urb_directory_cache.pop(os.path.join(parent_dir, stale_dir), None)
             try:
                 metrics.TOTAL_SIZE.remove(stale_dir)
                 metrics.LATEST_MTIME.remove(stale_dir)
@@ -262,11 +620,12 @@ def main() -> Never:
                 metrics.LAST_UPDATED.remove(stale_dir)
                 if args.enable_detailed_processing_time_metric:
                     metrics.PROCESSING_TIME.remove(stale_dir)
-                print(f"Cleaned up stale metrics for {stale_dir}")
+                logger.debug("Cleaned up stale metrics for %s", stale_dir)
             except KeyError:
                 pass
         
         active_directories = current_directories
+        run += 1
         time.sleep(args.wait_time_minutes * 60)
 
 
@@ -0,0 +1,181 @@
+"""
+Minimal stat() replacement using Linux's statx syscall.
+
+We only need the type, size and mtime of entries, so we ask the kernel for
+just those fields. AT_STATX_DONT_SYNC lets network filesystems (like NFS) answer
+from their attribute cache instead of revalidating with the server on each
+call, which is where most of our time goes.
+
+Falls back to os.stat wherever statx is not available.
+"""
+import ctypes
+import functools
+import os
+import platform
+from dataclasses import dataclass
+from typing import Optional
+
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_EMPTY_PATH = 0x1000
+AT_STATX_DONT_SYNC = 0x4000
+
+STATX_TYPE = 0x1
+STATX_MTIME = 0x40
+STATX_SIZE = 0x200
+
+# statx was added in Linux 4.11
+MIN_KERNEL_VERSION = (4, 11)
+
+# statx syscall numbers, by machine architecture
+SYSCALL_NUMBERS = {
+    "x86_64": 332,
+    "aarch64": 291,
+}
+
+
+class StatxTimestamp(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_int64),
+        ("tv_nsec", ctypes.c_uint32),
+        ("__reserved", ctypes.c_int32),
+    ]
+
+
+class Statx(ctypes.Structure):
+    """
+    struct statx, as defined in include/uapi/linux/stat.h
+    """
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("__spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", StatxTimestamp),
+        ("stx_btime", StatxTimestamp),
+        ("stx_ctime", StatxTimestamp),
+        ("stx_mtime", StatxTimestamp),
+        ("stx_rdev_major", ctypes.c_uint32),
+        ("stx_rdev_minor", ctypes.c_uint32),
+        ("stx_dev_major", ctypes.c_uint32),
+        ("stx_dev_minor", ctypes.c_uint32),
+        ("__spare2", ctypes.c_uint64 * 14),
+    ]
+
+
+@dataclass(slots=True)
+class StatResult:
+    """
+    The subset of os.stat_result that we actually use.
+    """
+    st_mode: int
+    st_size: int
+    st_mtime_ns: int
+
+
+@functools.cache
+def _get_statx_syscall():
+    """
+    Return a callable for the raw statx syscall, or None if it is unavailable.
+    """
+    if platform.system() != "Linux":
+        return None
+    syscall_number = SYSCALL_NUMBERS.get(platform.machine())
+    if syscall_number is None:
+        return None
+    try:
+        kernel_version = tuple(
+            int(part) for part in platform.release().split("-")[0].split(".")[:2]
+        )
+    except ValueError:
+        return None
+    if kernel_version < MIN_KERNEL_VERSION:
+        return None
+
+    # Load whichever libc the interpreter itself is linked against, so this
+    # works on both glibc and musl (alpine)
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+
+    def statx_syscall(dir_fd: int, path: bytes, flags: int, mask: int, buf: Statx) -> int:
+        return libc.syscall(
+            ctypes.c_long(syscall_number),
+            ctypes.c_int(dir_fd),
+            ctypes.c_char_p(path),
+            ctypes.c_int(flags),
+            ctypes.c_uint(mask),
+            ctypes.byref(buf),
+        )
+
+    # Make sure the syscall actually works here - it may be blocked by
+    # seccomp policies in some container runtimes.
+    if statx_syscall(AT_FDCWD, b"/", AT_STATX_DONT_SYNC, STATX_TYPE | STATX_SIZE | STATX_MTIME, Statx()) != 0:
+        return None
+    return statx_syscall
+
+
+def stat(
+    path: str | int, *, dir_fd: Optional[int] = None, follow_symlinks: bool = True
+) -> StatResult:
+    """
+    Return type, size & mtime of given path, similar to os.stat.
+
+    As with os.stat, path may be an open file descriptor, and if dir_fd is set,
+    path is resolved relative to that directory. Raises the same OSError
+    subclasses os.stat would on failure.
+
+    This is usually one syscall. If the filesystem does not return all the
+    fields we ask statx for, a second os.stat call is made to get them. Callers
+    budgeting IO only count one IO per call, so that retry is not counted.
+    """
+    statx_syscall = _get_statx_syscall()
+    if statx_syscall is None:
+        return _fallback_stat(path, dir_fd, follow_symlinks)
+
+    flags = AT_STATX_DONT_SYNC
+    if not follow_symlinks:
+        flags |= AT_SYMLINK_NOFOLLOW
+    if isinstance(path, int):
+        statx_dir_fd = path
+        statx_path = b""
+        flags |= AT_EMPTY_PATH
+    else:
+        statx_dir_fd = AT_FDCWD if dir_fd is None else dir_fd
+        statx_path = os.fsencode(path)
+    mask = STATX_TYPE | STATX_SIZE | STATX_MTIME
+    buf = Statx()
+    if statx_syscall(statx_dir_fd, statx_path, flags, mask, buf) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    if buf.stx_mask & mask != mask:
+        # Filesystem could not give us the fields we asked for. This second
+        # call is not counted against any IO budget (see docstring), but is
+        # not expected in practice - local filesystems and NFS always give us
+        # type, size & mtime.
+        return _fallback_stat(path, dir_fd, follow_symlinks)
+
+    return StatResult(
+        st_mode=buf.stx_mode,
+        st_size=buf.stx_size,
+        st_mtime_ns=buf.stx_mtime.tv_sec * 1_000_000_000 + buf.stx_mtime.tv_nsec,
+    )
+
+
+def _fallback_stat(
+    path: str | int, dir_fd: Optional[int], follow_symlinks: bool
+) -> StatResult:
+    stat_info = os.stat(path, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
+    return StatResult(
+        st_mode=stat_info.st_mode,
+        st_size=stat_info.st_size,
+        st_mtime_ns=stat_info.st_mtime_ns,
+    )